@@ -384,9 +384,8 @@ def apply_seamless_blend(
             return result
         except Exception:
             # Fallback to simple alpha blending
-            mask_3ch = np.stack([mask] * 3, axis=-1) / 255.0
-            result = (foreground * mask_3ch + background * (1 - mask_3ch)).astype(np.uint8)
-            return result
+            alpha = mask.astype(np.float32) / 255.0
+            return cv2.blendLinear(foreground, background, alpha, 1.0 - alpha)
 
     except Exception as e:
         print(f"Seamless blend error: {e}")
@@ -541,7 +540,7 @@ def generate_tryon_with_face_preservation(
         person_processed = preprocess_image(person_image)
         clothing_processed = preprocess_image(clothing_image)
 
-        person_np = np.array(person_processed)
+        person_np = np.asarray(person_processed)
         person_np = cv2.cvtColor(person_np, cv2.COLOR_RGB2BGR)
 
         # Step 2: Detect and extract face data from original
@@ -587,7 +586,7 @@ def generate_tryon_with_face_preservation(
             )
             method = "fallback"
 
-        result_np = np.array(result_image)
+        result_np = np.asarray(result_image)
         result_np = cv2.cvtColor(result_np, cv2.COLOR_RGB2BGR)
 
         # Step 4: Detect face in generated image
@@ -724,13 +723,11 @@ def swap_face_from_scratch(
         )
         mask = cv2.GaussianBlur(mask, (21, 21), 10)
 
-        # Blend face into target
+        # Blend face into target (one SIMD pass over all channels)
         result = target_image.copy()
-        for c in range(3):
-            result[paste_y:paste_y+new_h, paste_x:paste_x+new_w, c] = (
-                face_resized[:, :, c] * (mask / 255.0) +
-                result[paste_y:paste_y+new_h, paste_x:paste_x+new_w, c] * (1 - mask / 255.0)
-            ).astype(np.uint8)
+        alpha = mask.astype(np.float32) / 255.0
+        region = result[paste_y:paste_y+new_h, paste_x:paste_x+new_w]
+        region[:] = cv2.blendLinear(face_resized, region, alpha, 1.0 - alpha)
 
         return result
 
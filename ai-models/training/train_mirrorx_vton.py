@@ -17,8 +17,10 @@ License: Apache 2.0
 """
 
 import argparse
+import contextlib
 import os
 import logging
+import threading
 from pathlib import Path
 from dataclasses import dataclass, field
 from typing import Optional, List, Dict, Any
@@ -45,8 +47,10 @@ from diffusers import (
     StableDiffusionXLPipeline,
     UNet2DConditionModel,
 )
+from diffusers.models.attention_processor import AttnProcessor2_0
 from diffusers.optimization import get_scheduler
-from peft import LoraConfig, get_peft_model
+from peft import LoraConfig, get_peft_model, get_peft_model_state_dict
+from safetensors.torch import save_file
 
 # Accelerate for multi-GPU
 from accelerate import Accelerator
@@ -61,6 +65,13 @@ try:
 except ImportError:
     pass  # Will be defined below
 
+# Faster JSON decoding for large pairs.jsonl manifests (optional)
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 logger = get_logger(__name__)
 
 
@@ -94,10 +105,14 @@ class TrainingConfig:
     # Mixed precision
     mixed_precision: str = "bf16"  # bf16 for H100, fp16 for A100
 
+    # Memory
+    vae_encode_chunk_size: int = 8  # Images per VAE encode call
+
     # Data
     data_dir: str = "./data"
     image_size: int = 1024
     num_workers: int = 8
+    prefetch_factor: int = 4  # Batches buffered per worker
 
     # Loss weights
     diffusion_loss_weight: float = 1.0
@@ -142,6 +157,9 @@ class MirrorXTryOnDataset(Dataset):
     │   └── pairs.json       # Person-cloth-target triplets
     └── val/
         └── ...
+
+    Large datasets can ship pairs.jsonl (one triplet per line) instead;
+    only line offsets are kept in memory and entries are parsed on access.
     """
 
     def __init__(
@@ -156,19 +174,44 @@ class MirrorXTryOnDataset(Dataset):
         self.augment = augment and split == "train"
 
         # Load pairs
+        self.pairs_index_file = self.data_dir / "pairs.jsonl"
+        self._offsets = None
         pairs_file = self.data_dir / "pairs.json"
-        if pairs_file.exists():
+        if self.pairs_index_file.exists():
+            self.pairs = None
+            self._offsets = self._index_jsonl(self.pairs_index_file)
+        elif pairs_file.exists():
             with open(pairs_file, 'r') as f:
                 self.pairs = json.load(f)
         else:
             # Auto-discover pairs from directory structure
             self.pairs = self._discover_pairs()
 
-        logger.info(f"Loaded {len(self.pairs)} pairs from {split} split")
+        logger.info(f"Loaded {len(self)} pairs from {split} split")
 
         # Image transforms
         self.transform = self._get_transforms()
 
+    def _index_jsonl(self, path: Path) -> List[int]:
+        """Record the byte offset of every non-empty line in a JSONL file."""
+        offsets = []
+        pos = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    offsets.append(pos)
+                pos += len(line)
+        return offsets
+
+    def _get_pair(self, idx: int) -> Dict:
+        """Return a pair, reading it from pairs.jsonl when indexed lazily."""
+        if self._offsets is None:
+            return self.pairs[idx]
+
+        with open(self.pairs_index_file, 'rb') as f:
+            f.seek(self._offsets[idx])
+            return json_loads(f.readline())
+
     def _discover_pairs(self) -> List[Dict]:
         """Auto-discover image pairs from directory."""
         pairs = []
@@ -219,15 +262,17 @@ class MirrorXTryOnDataset(Dataset):
         return None
 
     def __len__(self):
+        if self._offsets is not None:
+            return len(self._offsets)
         return len(self.pairs)
 
     def __getitem__(self, idx: int) -> Dict[str, torch.Tensor]:
-        pair = self.pairs[idx]
+        pair = self._get_pair(idx)
 
         # Load images
-        person = Image.open(pair['person']).convert('RGB')
-        cloth = Image.open(pair['cloth']).convert('RGB')
-        target = Image.open(pair.get('target', pair['person'])).convert('RGB')
+        person = self._load_image(pair['person'])
+        cloth = self._load_image(pair['cloth'])
+        target = self._load_image(pair.get('target', pair['person']))
 
         # Load auxiliary data
         pose = self._load_pose(pair.get('pose'))
@@ -263,11 +308,27 @@ class MirrorXTryOnDataset(Dataset):
             'id': pair['id'],
         }
 
+    def _load_image(self, path: str) -> Image.Image:
+        """
+        Load an RGB image, decoding JPEGs at reduced scale when possible.
+
+        draft() lets libjpeg skip DCT coefficients it doesn't need, so large
+        source photos are decoded close to the training resolution instead
+        of at full size before the resize.
+        """
+        image = Image.open(path)
+        image.draft('RGB', (768, self.image_size))
+        return image.convert('RGB')
+
     def _to_tensor(self, image: Image.Image) -> torch.Tensor:
-        """Convert PIL image to normalized tensor."""
-        arr = np.array(image).astype(np.float32) / 255.0
-        arr = arr * 2 - 1  # Normalize to [-1, 1]
-        tensor = torch.from_numpy(arr).permute(2, 0, 1)
+        """
+        Convert PIL image to a uint8 CHW tensor.
+
+        Normalization to [-1, 1] happens on the GPU in the training dtype,
+        so only 1 byte per channel goes through the host-device copy.
+        """
+        arr = np.asarray(image, dtype=np.uint8)
+        tensor = torch.from_numpy(arr).permute(2, 0, 1).contiguous()
         return tensor
 
     def _load_pose(self, pose_path: Optional[str]) -> Optional[np.ndarray]:
@@ -286,6 +347,57 @@ class MirrorXTryOnDataset(Dataset):
         return None
 
 
+class CUDAPrefetcher:
+    """
+    Wraps a dataloader and copies the next batch to the GPU on a side stream
+    while the current batch is being processed.
+    """
+
+    def __init__(self, loader: DataLoader, device: torch.device):
+        self.loader = loader
+        self.device = device
+        self.stream = torch.cuda.Stream(device=device) if device.type == "cuda" else None
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _to_device(self, batch: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            key: value.to(self.device, non_blocking=True) if isinstance(value, torch.Tensor) else value
+            for key, value in batch.items()
+        }
+
+    def _preload(self, loader_iter) -> Optional[Dict[str, Any]]:
+        try:
+            batch = next(loader_iter)
+        except StopIteration:
+            return None
+
+        with torch.cuda.stream(self.stream):
+            return self._to_device(batch)
+
+    def __iter__(self):
+        if self.stream is None:
+            for batch in self.loader:
+                yield self._to_device(batch)
+            return
+
+        loader_iter = iter(self.loader)
+        next_batch = self._preload(loader_iter)
+
+        while next_batch is not None:
+            # Make the compute stream wait for the copy before using the batch
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_stream(self.stream)
+            batch = next_batch
+            for value in batch.values():
+                if isinstance(value, torch.Tensor):
+                    value.record_stream(current_stream)
+
+            next_batch = self._preload(loader_iter)
+            yield batch
+
+
 # ============================================
 # Loss Functions
 # ============================================
@@ -444,16 +556,21 @@ class MirrorXTrainer:
         # Training state
         self.global_step = 0
         self.best_val_loss = float('inf')
+        self._noise_buf = None  # Allocated on the first step
+        self._cond_buf = None
+        self._save_thread = None
 
     def _load_models(self):
         """Load and configure models."""
         logger.info(f"Loading model from {self.config.pretrained_model_name}")
 
+        self.weight_dtype = torch.bfloat16 if self.config.mixed_precision == "bf16" else torch.float16
+
         # Load VAE
         self.vae = AutoencoderKL.from_pretrained(
             self.config.pretrained_model_name,
             subfolder="vae",
-            torch_dtype=torch.bfloat16 if self.config.mixed_precision == "bf16" else torch.float16,
+            torch_dtype=self.weight_dtype,
         )
         self.vae.requires_grad_(False)
 
@@ -461,9 +578,20 @@ class MirrorXTrainer:
         self.unet = UNet2DConditionModel.from_pretrained(
             self.config.pretrained_model_name,
             subfolder="unet",
-            torch_dtype=torch.bfloat16 if self.config.mixed_precision == "bf16" else torch.float16,
+            torch_dtype=self.weight_dtype,
         )
 
+        # Use native SDPA attention and keep it on the fused Flash /
+        # memory-efficient kernels rather than the math fallback
+        self.unet.set_attn_processor(AttnProcessor2_0())
+        try:
+            from torch.nn.attention import SDPBackend, sdpa_kernel
+            self._sdpa_ctx = lambda: sdpa_kernel(
+                [SDPBackend.FLASH_ATTENTION, SDPBackend.EFFICIENT_ATTENTION]
+            )
+        except ImportError:  # PyTorch < 2.3
+            self._sdpa_ctx = contextlib.nullcontext
+
         # Apply LoRA
         if self.config.use_lora:
             logger.info(f"Applying LoRA with rank {self.config.lora_rank}")
@@ -517,20 +645,29 @@ class MirrorXTrainer:
             augment=False,
         )
 
+        # Keep workers alive across epochs so the first batch of each epoch
+        # doesn't wait on worker respawn
+        num_workers = min(self.config.num_workers, max(2, (os.cpu_count() or 2) // 2))
+
         self.train_dataloader = DataLoader(
             self.train_dataset,
             batch_size=self.config.batch_size,
             shuffle=True,
-            num_workers=self.config.num_workers,
+            num_workers=num_workers,
             pin_memory=True,
+            persistent_workers=num_workers > 0,
+            prefetch_factor=self.config.prefetch_factor if num_workers > 0 else None,
         )
 
+        # Validation only runs every eval_every steps, so don't keep idle
+        # workers and their pinned prefetch buffers alive in between
         self.val_dataloader = DataLoader(
             self.val_dataset,
             batch_size=self.config.batch_size,
             shuffle=False,
-            num_workers=self.config.num_workers,
+            num_workers=num_workers,
             pin_memory=True,
+            persistent_workers=False,
         )
 
     def _init_losses(self):
@@ -541,12 +678,17 @@ class MirrorXTrainer:
 
     def _init_optimizer(self):
         """Initialize optimizer and learning rate scheduler."""
+        # Fused AdamW validates parameter devices at construction, so move
+        # the UNet first (accelerate.prepare would do this anyway)
+        self.unet.to(self.accelerator.device)
         trainable_params = [p for p in self.unet.parameters() if p.requires_grad]
 
+        # Fused kernel collapses the per-parameter update ops (CUDA only)
         self.optimizer = AdamW(
             trainable_params,
             lr=self.config.learning_rate,
             weight_decay=self.config.weight_decay,
+            fused=torch.cuda.is_available(),
         )
 
         num_training_steps = len(self.train_dataloader) * self.config.num_epochs
@@ -563,47 +705,56 @@ class MirrorXTrainer:
         (
             self.unet,
             self.optimizer,
-            self.train_dataloader,
-            self.val_dataloader,
             self.lr_scheduler,
         ) = self.accelerator.prepare(
             self.unet,
             self.optimizer,
-            self.train_dataloader,
-            self.val_dataloader,
             self.lr_scheduler,
         )
 
-        self.vae.to(self.accelerator.device)
+        # Dataloaders are sharded by accelerate but moved to device by the
+        # prefetcher, so the H2D copy overlaps with the previous step
+        self.train_dataloader = CUDAPrefetcher(
+            self.accelerator.prepare_data_loader(self.train_dataloader, device_placement=False),
+            self.accelerator.device,
+        )
+        self.val_dataloader = CUDAPrefetcher(
+            self.accelerator.prepare_data_loader(self.val_dataloader, device_placement=False),
+            self.accelerator.device,
+        )
+
+        # Conv-heavy VAE picks faster NHWC kernels on Ampere+
+        self.vae.to(self.accelerator.device, memory_format=torch.channels_last)
         self.text_encoder.to(self.accelerator.device)
         self.perceptual_loss.to(self.accelerator.device)
 
     def train_step(self, batch: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
         """Single training step."""
-        person = batch['person']
-        cloth = batch['cloth']
-        target = batch['target']
+        person = self._normalize_images(batch['person'])
+        cloth = self._normalize_images(batch['cloth'])
+        target = self._normalize_images(batch['target'])
         cloth_mask = batch.get('cloth_mask')
 
-        # Encode images to latent space
+        # Encode images to latent space in a single VAE pass; chunk() returns
+        # views, so the split doesn't allocate
         with torch.no_grad():
-            person_latents = self.vae.encode(person).latent_dist.sample()
-            cloth_latents = self.vae.encode(cloth).latent_dist.sample()
-            target_latents = self.vae.encode(target).latent_dist.sample()
-
-            # Scale latents
             scaling_factor = self.vae.config.scaling_factor
-            person_latents = person_latents * scaling_factor
-            cloth_latents = cloth_latents * scaling_factor
-            target_latents = target_latents * scaling_factor
+            images = torch.cat([person, cloth, target]).contiguous(memory_format=torch.channels_last)
+            latents = self._encode_latents(images)
+            latents.mul_(scaling_factor)
+            person_latents, cloth_latents, target_latents = latents.chunk(3)
 
         # Add noise to target latents
-        noise = torch.randn_like(target_latents)
+        noise = self._sample_noise(target_latents)
         bsz = target_latents.shape[0]
-        timesteps = torch.randint(
-            0, self.noise_scheduler.config.num_train_timesteps,
-            (bsz,), device=self.accelerator.device
-        )
+
+        # Stratified timesteps: one sample per equal-width bin across the
+        # batch gives lower-variance coverage than independent draws
+        num_timesteps = self.noise_scheduler.config.num_train_timesteps
+        strata = torch.arange(bsz, device=self.accelerator.device)
+        timesteps = (
+            (strata + torch.rand(bsz, device=self.accelerator.device)) * (num_timesteps / bsz)
+        ).long()
         noisy_latents = self.noise_scheduler.add_noise(target_latents, noise, timesteps)
 
         # Create conditioning (concatenate person and cloth latents)
@@ -611,11 +762,12 @@ class MirrorXTrainer:
         encoder_hidden_states = self._encode_conditioning(person_latents, cloth_latents)
 
         # Predict noise
-        noise_pred = self.unet(
-            noisy_latents,
-            timesteps,
-            encoder_hidden_states=encoder_hidden_states,
-        ).sample
+        with self._sdpa_ctx():
+            noise_pred = self.unet(
+                noisy_latents,
+                timesteps,
+                encoder_hidden_states=encoder_hidden_states,
+            ).sample
 
         # Diffusion loss
         diffusion_loss = F.mse_loss(noise_pred, noise)
@@ -651,28 +803,59 @@ class MirrorXTrainer:
             'garment_loss': garment_loss,
         }
 
+    def _encode_latents(self, images: torch.Tensor) -> torch.Tensor:
+        """VAE-encode images in chunks to bound peak activation memory."""
+        chunk_size = self.config.vae_encode_chunk_size
+        return torch.cat([
+            self.vae.encode(images[i:i + chunk_size]).latent_dist.sample()
+            for i in range(0, images.shape[0], chunk_size)
+        ])
+
+    def _sample_noise(self, latents: torch.Tensor) -> torch.Tensor:
+        """Fill a persistent buffer with Gaussian noise shaped like latents."""
+        if (
+            self._noise_buf is None
+            or self._noise_buf.shape != latents.shape
+            or self._noise_buf.dtype != latents.dtype
+        ):
+            self._noise_buf = torch.empty_like(latents, memory_format=torch.contiguous_format)
+        return self._noise_buf.normal_()
+
+    def _normalize_images(self, images: torch.Tensor) -> torch.Tensor:
+        """Move uint8 images to the device and scale to [-1, 1] in the weight dtype."""
+        images = images.to(self.accelerator.device, non_blocking=True)
+        return images.to(self.weight_dtype).mul_(1 / 127.5).sub_(1.0)
+
     def _encode_conditioning(
         self,
         person_latents: torch.Tensor,
         cloth_latents: torch.Tensor,
     ) -> torch.Tensor:
         """Encode conditioning information."""
-        # Simplified: concatenate and project
+        # Simplified: the person/cloth latents are not projected yet
         # Full implementation would use cross-attention mechanism
-        combined = torch.cat([person_latents, cloth_latents], dim=1)
 
         # Create dummy text embedding shape for compatibility
         bsz = person_latents.shape[0]
         text_embed_dim = 768  # CLIP embedding dimension
         seq_len = 77  # CLIP sequence length
 
-        # Project combined latents to text embedding space
-        # This is a placeholder - real implementation needs proper attention
-        hidden_states = torch.zeros(
-            bsz, seq_len, text_embed_dim,
-            device=person_latents.device,
-            dtype=person_latents.dtype,
-        )
+        # This is a placeholder - real implementation needs proper attention.
+        # The placeholder is constant, so allocate it once and reuse it
+        # instead of creating a fresh zero tensor every step.
+        shape = (bsz, seq_len, text_embed_dim)
+        hidden_states = self._cond_buf
+        if (
+            hidden_states is None
+            or hidden_states.shape != shape
+            or hidden_states.dtype != person_latents.dtype
+        ):
+            hidden_states = torch.zeros(
+                shape,
+                device=person_latents.device,
+                dtype=person_latents.dtype,
+            )
+            self._cond_buf = hidden_states
 
         return hidden_states
 
@@ -687,21 +870,28 @@ class MirrorXTrainer:
             disable=not self.accelerator.is_main_process,
         )
 
-        for batch in progress_bar:
-            with self.accelerator.accumulate(self.unet):
-                losses = self.train_step(batch)
+        accum_steps = self.config.gradient_accumulation_steps
+        num_batches = len(self.train_dataloader)
+
+        for step, batch in enumerate(progress_bar):
+            # Only all-reduce gradients on the last microbatch of each
+            # accumulation window (or the last batch of the epoch)
+            sync = (step + 1) % accum_steps == 0 or (step + 1) == num_batches
+            ctx = contextlib.nullcontext() if sync else self.accelerator.no_sync(self.unet)
 
+            with ctx:
+                losses = self.train_step(batch)
                 self.accelerator.backward(losses['total_loss'])
 
-                if self.accelerator.sync_gradients:
-                    self.accelerator.clip_grad_norm_(
-                        self.unet.parameters(),
-                        self.config.max_grad_norm,
-                    )
+            if sync:
+                self.accelerator.clip_grad_norm_(
+                    self.unet.parameters(),
+                    self.config.max_grad_norm,
+                )
 
                 self.optimizer.step()
                 self.lr_scheduler.step()
-                self.optimizer.zero_grad()
+                self.optimizer.zero_grad(set_to_none=True)
 
             epoch_losses.append(losses['total_loss'].item())
             self.global_step += 1
@@ -771,9 +961,25 @@ class MirrorXTrainer:
         output_dir = Path(self.config.output_dir) / name
         output_dir.mkdir(parents=True, exist_ok=True)
 
-        # Save LoRA weights
         unwrapped_unet = self.accelerator.unwrap_model(self.unet)
-        unwrapped_unet.save_pretrained(output_dir)
+
+        if self.config.use_lora:
+            # Save only the LoRA tensors; snapshot them to CPU here and write
+            # to disk on a background thread so training isn't blocked
+            lora_state_dict = {
+                key: value.detach().to("cpu", copy=True).contiguous()
+                for key, value in get_peft_model_state_dict(unwrapped_unet).items()
+            }
+            unwrapped_unet.peft_config["default"].save_pretrained(output_dir)
+
+            self._wait_for_checkpoint()
+            self._save_thread = threading.Thread(
+                target=save_file,
+                args=(lora_state_dict, str(output_dir / "adapter_model.safetensors")),
+            )
+            self._save_thread.start()
+        else:
+            unwrapped_unet.save_pretrained(output_dir)
 
         # Save training state
         state = {
@@ -786,6 +992,12 @@ class MirrorXTrainer:
 
         logger.info(f"Saved checkpoint to {output_dir}")
 
+    def _wait_for_checkpoint(self):
+        """Block until the previous background checkpoint write finishes."""
+        if self._save_thread is not None:
+            self._save_thread.join()
+            self._save_thread = None
+
     def train(self):
         """Full training loop."""
         logger.info("Starting training...")
@@ -808,6 +1020,7 @@ class MirrorXTrainer:
 
         # Save final model
         self._save_checkpoint("final_model")
+        self._wait_for_checkpoint()
 
         if self.config.use_wandb and self.accelerator.is_main_process:
             wandb.finish()
@@ -18,27 +18,140 @@ API Endpoints:
 """
 
 import os
-import io
+import asyncio
 import base64
+import gc
+import hashlib
 import logging
-from typing import Optional, Tuple
+import threading
+import types
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
 from contextlib import asynccontextmanager
 
+# Must be set before torch initializes CUDA: expandable segments let the
+# allocator grow in place instead of fragmenting across requests
+os.environ.setdefault(
+    "PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True,max_split_size_mb:512"
+)
+
+import cv2
 import numpy as np
 import torch
 from PIL import Image
 from fastapi import FastAPI, HTTPException, File, UploadFile, Form
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, Field
 import uvicorn
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# SIMD hashing for image cache keys (optional, falls back to blake2b)
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# libjpeg-turbo bindings for faster JPEG decoding/encoding (optional)
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    turbo_jpeg = TurboJPEG()
+except Exception:
+    turbo_jpeg = None
+
+# Wheel-bundled libjpeg-turbo, for hosts without the system library (optional)
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
 # Global model instances
 models = {}
 
+# Text-encoder outputs for the fixed try-on prompts, encoded once at startup
+prompt_cache = {}
+
+# Threads for CPU-bound work (decode/encode/generation) off the event loop
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "4"))
+
+# Diffusion resolution as (width, height)
+PIPELINE_SIZE = (512, 768)
+
+# Fast tier: LCM-LoRA distills SD inpainting to ~4 steps without CFG
+USE_LCM_LORA = os.getenv("USE_LCM_LORA", "0") == "1"
+
+# Diffusion steps per try-on (DPM-Solver++ converges in ~15, LCM in ~4)
+DEFAULT_INFERENCE_STEPS = int(
+    os.getenv("INFERENCE_STEPS", "4" if USE_LCM_LORA else "15")
+)
+
+# LCM is trained without classifier-free guidance
+GUIDANCE_SCALE = 1.0 if USE_LCM_LORA else 7.5
+
+# Prompts for clothing placement (identical for every request)
+TRYON_PROMPT = (
+    "professional fashion photo, person wearing the clothing item, "
+    "realistic, high quality, detailed, natural lighting, "
+    "clothing fits naturally on body"
+)
+
+TRYON_NEGATIVE_PROMPT = (
+    "blurry, low quality, distorted, unrealistic, "
+    "wrong proportions, artifacts, watermark"
+)
+
+# Only offload weights to CPU on GPUs with less free VRAM than this
+OFFLOAD_VRAM_GB = float(os.getenv("OFFLOAD_VRAM_GB", "12"))
+
+# INT8 face swapper produced by quantize_models.py (used when present)
+INSWAPPER_INT8_PATH = os.path.expanduser(
+    os.getenv("INSWAPPER_INT8_PATH", "~/.insightface/models/inswapper_128_int8.onnx")
+)
+
+# MediaPipe pose landmark model converted to ONNX (used when present)
+POSE_ONNX_PATH = os.path.expanduser(
+    os.getenv("POSE_ONNX_PATH", "~/.mediapipe/pose_landmark_full.onnx")
+)
+
+# DeepCache: reuse high-level UNet features for this many steps (0 = off)
+DEEPCACHE_INTERVAL = int(os.getenv("DEEPCACHE_INTERVAL", "0"))
+
+# JIT-compile the UNet and VAE decoder (first call pays the compile cost)
+TORCH_COMPILE = os.getenv("TORCH_COMPILE", "1") == "1"
+
+# Fixed input shapes: let cuDNN autotune once, and use TF32 for fp32 ops
+torch.backends.cudnn.benchmark = True
+torch.backends.cuda.matmul.allow_tf32 = True
+torch.backends.cudnn.allow_tf32 = True
+
+
+def get_model_dtype() -> torch.dtype:
+    """
+    Pipeline dtype from MODEL_PRECISION (auto, bf16 or fp16)
+
+    auto picks bf16 on GPUs that support it (Ampere+): same throughput as
+    fp16 without the overflow NaNs that force upcasts
+    """
+    precision = os.getenv("MODEL_PRECISION", "auto").lower()
+    if precision == "fp16":
+        return torch.float16
+    if precision == "bf16":
+        return torch.bfloat16
+    # Check the compute capability: is_bf16_supported() also counts
+    # emulated bf16 on pre-Ampere cards (T4/V100), which would lose the
+    # fp16 tensor cores
+    if torch.cuda.is_available() and torch.cuda.get_device_capability()[0] >= 8:
+        return torch.bfloat16
+    return torch.float16
+
+
+MODEL_DTYPE = get_model_dtype()
+
 
 # ============================================================================
 # Model Loading
@@ -67,6 +180,25 @@ def load_face_swapper():
     try:
         import insightface
 
+        if os.path.exists(INSWAPPER_INT8_PATH):
+            # Prefer TensorRT for the QDQ model; ORT's CUDA EP falls back to
+            # slow INT8 kernels for some ops
+            swapper = insightface.model_zoo.get_model(
+                INSWAPPER_INT8_PATH,
+                providers=[
+                    ('TensorrtExecutionProvider', {
+                        'trt_int8_enable': True,
+                        'trt_fp16_enable': True,
+                        'trt_engine_cache_enable': True,
+                        'trt_engine_cache_path': os.path.dirname(INSWAPPER_INT8_PATH),
+                    }),
+                    'CUDAExecutionProvider',
+                    'CPUExecutionProvider'
+                ]
+            )
+            logger.info("INT8 face swapper loaded successfully")
+            return swapper
+
         model_path = os.path.expanduser('~/.insightface/models/inswapper_128.onnx')
 
         # Download if not exists
@@ -102,7 +234,8 @@ def load_tryon_pipeline():
         from diffusers import (
             StableDiffusionInpaintPipeline,
             AutoencoderKL,
-            UniPCMultistepScheduler
+            DPMSolverMultistepScheduler,
+            LCMScheduler
         )
 
         # Using SD Inpainting as a starter (replace with IDM-VTON for better results)
@@ -110,20 +243,83 @@ def load_tryon_pipeline():
 
         pipeline = StableDiffusionInpaintPipeline.from_pretrained(
             model_id,
-            torch_dtype=torch.float16,
+            torch_dtype=MODEL_DTYPE,
             safety_checker=None,
             requires_safety_checker=False
         )
 
+        # bf16 has fp32's exponent range, so the VAE never needs upcasting
+        if MODEL_DTYPE == torch.bfloat16:
+            pipeline.vae.register_to_config(force_upcast=False)
+
+        # Fuse the LCM-LoRA into the UNet weights so it costs nothing per step
+        if USE_LCM_LORA:
+            pipeline.load_lora_weights("latent-consistency/lcm-lora-sdv1-5")
+            pipeline.fuse_lora()
+
         # Optimizations
-        pipeline.to("cuda")
-        pipeline.enable_model_cpu_offload()
+        # CPU offload moves weights over PCIe on every call, so only use it
+        # when the whole pipeline doesn't fit on the GPU
+        free_vram, _ = torch.cuda.mem_get_info()
+        cpu_offload = free_vram < OFFLOAD_VRAM_GB * 1024**3
+        if cpu_offload:
+            logger.info(f"{free_vram / 1024**3:.1f}GB VRAM free, enabling CPU offload")
+            pipeline.enable_model_cpu_offload()
+            # Decode the latents in tiles to keep the VAE's peak VRAM down
+            pipeline.enable_vae_tiling()
+        else:
+            pipeline.to("cuda")
         pipeline.enable_vae_slicing()
 
-        # Faster scheduler
-        pipeline.scheduler = UniPCMultistepScheduler.from_config(
-            pipeline.scheduler.config
-        )
+        # NHWC lets cuDNN pick tensor-core conv kernels for the UNet and VAE
+        pipeline.unet.to(memory_format=torch.channels_last)
+        pipeline.vae.to(memory_format=torch.channels_last)
+
+        try:
+            pipeline.enable_xformers_memory_efficient_attention()
+        except Exception as e:
+            # PyTorch 2 SDPA dispatches to the same flash/memory-efficient
+            # kernels (and torch.compile traces it without graph breaks)
+            from diffusers.models.attention_processor import AttnProcessor2_0
+
+            pipeline.unet.set_attn_processor(AttnProcessor2_0())
+            pipeline.vae.set_attn_processor(AttnProcessor2_0())
+            logger.warning(f"xformers not available, using PyTorch SDPA attention: {e}")
+
+        # Faster scheduler: DPM-Solver++ 2M Karras reaches converged
+        # quality in ~15 steps
+        if USE_LCM_LORA:
+            pipeline.scheduler = LCMScheduler.from_config(pipeline.scheduler.config)
+        else:
+            pipeline.scheduler = DPMSolverMultistepScheduler.from_config(
+                pipeline.scheduler.config,
+                algorithm_type="dpmsolver++",
+                use_karras_sigmas=True
+            )
+
+        # Adjacent denoising steps have near-identical deep features, so
+        # only the shallow UNet branch is recomputed between full passes
+        deepcache = DEEPCACHE_INTERVAL > 1
+        if deepcache:
+            from DeepCache import DeepCacheSDHelper
+
+            helper = DeepCacheSDHelper(pipe=pipeline)
+            helper.set_params(cache_interval=DEEPCACHE_INTERVAL, cache_branch_id=0)
+            helper.enable()
+            logger.info(f"DeepCache enabled (interval {DEEPCACHE_INTERVAL})")
+
+        # Compiled graphs don't mix with offload hooks moving weights around,
+        # or with DeepCache's step-dependent UNet patching
+        if TORCH_COMPILE and not cpu_offload and not deepcache:
+            # Input shapes are fixed by PIPELINE_SIZE, so skip dynamic-shape
+            # tracing and specialize on them
+            pipeline.unet = torch.compile(
+                pipeline.unet, mode="reduce-overhead", fullgraph=True, dynamic=False
+            )
+            pipeline.vae.decode = torch.compile(
+                pipeline.vae.decode, mode="reduce-overhead"
+            )
+            logger.info("Compiled UNet and VAE decoder with torch.compile")
 
         logger.info("Try-on pipeline loaded successfully")
         return pipeline
@@ -133,14 +329,118 @@ def load_tryon_pipeline():
         return None
 
 
+class OnnxPoseEstimator:
+    """
+    MediaPipe pose landmark model running under ONNX Runtime on the GPU
+
+    Mirrors mp.solutions.pose.Pose: process() returns an object whose
+    pose_landmarks.landmark holds normalized x/y per landmark. There is no
+    separate person detector, so the whole (letterboxed) photo is used as
+    the ROI, which suits single-person try-on photos.
+    """
+
+    INPUT_SIZE = 256
+    NUM_LANDMARKS = 33
+    # 33 pose + 6 auxiliary landmarks, 5 values each
+    LANDMARK_OUTPUT_SIZE = 39 * 5
+
+    def __init__(self, model_path: str, min_detection_confidence: float = 0.5):
+        import onnxruntime as ort
+
+        sess_options = ort.SessionOptions()
+        sess_options.enable_mem_pattern = True
+        self.session = ort.InferenceSession(
+            model_path,
+            sess_options,
+            providers=['CUDAExecutionProvider', 'CPUExecutionProvider']
+        )
+        model_input = self.session.get_inputs()[0]
+        dtype = np.float16 if model_input.type == 'tensor(float16)' else np.float32
+        # tflite2onnx may keep TFLite's NHWC layout or convert to NCHW
+        self.channels_first = model_input.shape[1] == 3
+        self.min_detection_confidence = min_detection_confidence
+
+        # Fixed-size buffers, bound once so each call only refills them
+        size = self.INPUT_SIZE
+        self._canvas = np.zeros((size, size, 3), dtype=np.uint8)
+        if self.channels_first:
+            self._input = np.zeros((1, 3, size, size), dtype=dtype)
+            self._input_hwc = self._input[0].transpose(1, 2, 0)
+        else:
+            self._input = np.zeros((1, size, size, 3), dtype=dtype)
+            self._input_hwc = self._input[0]
+
+        # Bind only the landmark and pose-flag outputs, so the segmentation
+        # and heatmap tensors are never copied back to the host
+        def static_size(output) -> int:
+            return int(np.prod([d if isinstance(d, int) else 1 for d in output.shape]))
+
+        outputs = self.session.get_outputs()
+        self._landmarks_name = next(
+            o.name for o in outputs if static_size(o) == self.LANDMARK_OUTPUT_SIZE
+        )
+        self._flag_name = next((o.name for o in outputs if static_size(o) == 1), None)
+
+        self._binding = self.session.io_binding()
+        self._binding.bind_cpu_input(model_input.name, self._input)
+        self._binding.bind_output(self._landmarks_name)
+        if self._flag_name is not None:
+            self._binding.bind_output(self._flag_name)
+
+    def process(self, image: np.ndarray) -> types.SimpleNamespace:
+        h, w = image.shape[:2]
+        scale = self.INPUT_SIZE / max(h, w)
+        new_w, new_h = max(1, round(w * scale)), max(1, round(h * scale))
+        top, left = (self.INPUT_SIZE - new_h) // 2, (self.INPUT_SIZE - new_w) // 2
+
+        # Not thread-safe (shared buffers): callers serialize via pose_lock
+        # Letterbox into the square input so the aspect ratio is preserved
+        self._canvas.fill(0)
+        self._canvas[top:top + new_h, left:left + new_w] = cv2.resize(
+            image, (new_w, new_h), interpolation=cv2.INTER_LINEAR
+        )
+        np.multiply(self._canvas, 1.0 / 255.0, out=self._input_hwc, casting='unsafe')
+
+        self.session.run_with_iobinding(self._binding)
+        outputs = self._binding.copy_outputs_to_cpu()
+
+        # Bound outputs: landmarks (1, 195) as x, y, z, visibility, presence
+        # per landmark in input pixels, then the (1, 1) pose presence score
+        landmarks_out = outputs[0]
+        flag_out = outputs[1] if self._flag_name is not None else None
+        if flag_out is not None and float(flag_out.ravel()[0]) < self.min_detection_confidence:
+            return types.SimpleNamespace(pose_landmarks=None)
+
+        points = landmarks_out.reshape(-1, 5)[:self.NUM_LANDMARKS].astype(np.float32)
+        xs = (points[:, 0] - left) / new_w
+        ys = (points[:, 1] - top) / new_h
+        visibility = 1.0 / (1.0 + np.exp(-points[:, 3]))
+
+        landmark = [
+            types.SimpleNamespace(x=float(x), y=float(y), visibility=float(v))
+            for x, y, v in zip(xs, ys, visibility)
+        ]
+        return types.SimpleNamespace(
+            pose_landmarks=types.SimpleNamespace(landmark=landmark)
+        )
+
+
 def load_pose_estimator():
-    """Load MediaPipe pose estimator"""
+    """Load pose estimator (ONNX on GPU when converted, else MediaPipe)"""
+    if os.path.exists(POSE_ONNX_PATH):
+        try:
+            pose = OnnxPoseEstimator(POSE_ONNX_PATH, min_detection_confidence=0.5)
+            logger.info("ONNX pose estimator loaded successfully")
+            return pose
+        except Exception as e:
+            logger.warning(f"Failed to load ONNX pose model, using MediaPipe: {e}")
+
     try:
         import mediapipe as mp
 
         pose = mp.solutions.pose.Pose(
             static_image_mode=True,
-            model_complexity=2,
+            model_complexity=1,  # Torso bbox doesn't need the heavy model
             min_detection_confidence=0.5
         )
         logger.info("Pose estimator loaded successfully")
@@ -150,6 +450,92 @@ def load_pose_estimator():
         return None
 
 
+def encode_prompts(pipeline) -> dict:
+    """
+    Encode the fixed try-on prompts once, so requests pass embeddings
+    to the pipeline and skip the CLIP text encoder
+    """
+    with torch.inference_mode():
+        prompt_embeds, negative_prompt_embeds = pipeline.encode_prompt(
+            TRYON_PROMPT,
+            device=pipeline._execution_device,
+            num_images_per_prompt=1,
+            # Without CFG (LCM) the negative prompt is never used
+            do_classifier_free_guidance=GUIDANCE_SCALE > 1.0,
+            negative_prompt=TRYON_NEGATIVE_PROMPT
+        )
+    return {
+        "prompt_embeds": prompt_embeds,
+        "negative_prompt_embeds": negative_prompt_embeds
+    }
+
+
+def free_text_encoder(pipeline):
+    """Drop the text encoder once prompts are cached (~500MB of VRAM)"""
+    pipeline.text_encoder = None
+    pipeline.tokenizer = None
+    gc.collect()
+    torch.cuda.empty_cache()
+
+
+# ============================================================================
+# Caching
+# ============================================================================
+
+class LRUCache:
+    """Small thread-safe LRU cache for per-image preprocessing results"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+def image_key(image: np.ndarray) -> str:
+    """Content hash of an image, used as a cache key"""
+    h = xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b(digest_size=16)
+    h.update(str(image.shape).encode())
+    h.update(np.ascontiguousarray(image))
+    return h.hexdigest()
+
+
+# Users typically try many garments on the same photo
+body_box_cache = LRUCache(maxsize=64)
+face_cache = LRUCache(maxsize=128)
+
+def request_key(*parts: Any) -> str:
+    """Hash of a request's full inputs, used to coalesce duplicates"""
+    h = xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+# Distinguishes a cache miss from a cached "no face found"
+_MISSING = object()
+
+# Separate from the request pool so preprocessing can't deadlock waiting
+# on threads held by generate_tryon itself
+preprocess_executor = ThreadPoolExecutor(
+    max_workers=WORKER_THREADS, thread_name_prefix="preprocess"
+)
+
+
 # ============================================================================
 # Core Processing Functions
 # ============================================================================
@@ -159,25 +545,84 @@ def decode_base64_image(b64_string: str) -> np.ndarray:
     if b64_string.startswith('data:image'):
         b64_string = b64_string.split(',')[1]
 
-    img_bytes = base64.b64decode(b64_string)
-    img = Image.open(io.BytesIO(img_bytes)).convert('RGB')
-    return np.array(img)
+    return decode_image_bytes(base64.b64decode(b64_string))
+
+
+def decode_image_bytes(img_bytes: bytes) -> np.ndarray:
+    """Decode encoded image bytes to RGB numpy array"""
+    # JPEG (almost every upload): libjpeg-turbo decodes straight to RGB,
+    # skipping the BGR->RGB pass; it ignores EXIF orientation like PIL
+    if turbo_jpeg is not None and img_bytes[:3] == b'\xff\xd8\xff':
+        try:
+            return turbo_jpeg.decode(img_bytes, pixel_format=TJPF_RGB)
+        except OSError:
+            pass  # Let OpenCV try (and report) malformed files
+
+    # Decode straight from the byte buffer (libjpeg-turbo in OpenCV), no
+    # PIL image + copy into numpy; orientation handling matches PIL's
+    buf = np.frombuffer(img_bytes, dtype=np.uint8)
+    img = cv2.imdecode(buf, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if img is None:
+        raise ValueError("Could not decode image")
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img)
 
 
 def encode_image_to_base64(image: np.ndarray, quality: int = 95) -> str:
-    """Encode numpy array to base64 string"""
-    img = Image.fromarray(image)
-    buffer = io.BytesIO()
-    img.save(buffer, format='JPEG', quality=quality)
-    return base64.b64encode(buffer.getvalue()).decode()
+    """Encode RGB numpy array to base64 JPEG string"""
+    if turbo_jpeg is not None:
+        jpeg_bytes = turbo_jpeg.encode(image, quality=quality, pixel_format=TJPF_RGB)
+    elif simplejpeg is not None:
+        jpeg_bytes = simplejpeg.encode_jpeg(
+            np.ascontiguousarray(image), quality=quality, colorspace='RGB'
+        )
+    else:
+        _, buffer = cv2.imencode(
+            '.jpg',
+            cv2.cvtColor(image, cv2.COLOR_RGB2BGR),
+            [cv2.IMWRITE_JPEG_QUALITY, quality]
+        )
+        jpeg_bytes = buffer.tobytes()
+    return base64.b64encode(jpeg_bytes).decode()
 
 
-def extract_face(image: np.ndarray) -> Optional[dict]:
-    """Extract face data from image"""
+def resize_image(
+    image: np.ndarray,
+    size: Tuple[int, int],
+    upscale_interpolation: int = cv2.INTER_LINEAR
+) -> np.ndarray:
+    """
+    Resize to (width, height) with OpenCV's SIMD resize
+
+    Returns the input itself (not a copy) when it is already that size
+    """
+    h, w = image.shape[:2]
+    if (w, h) == tuple(size):
+        return image
+    # Area averaging avoids aliasing when shrinking
+    if size[0] * size[1] < w * h:
+        interpolation = cv2.INTER_AREA
+    else:
+        interpolation = upscale_interpolation
+    return cv2.resize(image, size, interpolation=interpolation)
+
+
+def extract_face(image: np.ndarray, key: Optional[str] = None) -> Optional[dict]:
+    """Extract face data from image, reusing results for repeat images"""
     face_app = models.get('face_analyzer')
     if face_app is None:
         return None
 
+    if key is None:
+        key = image_key(image)
+    face = face_cache.get(key, _MISSING)
+    if face is _MISSING:
+        face = detect_largest_face(face_app, image)
+        face_cache.put(key, face)
+    return face
+
+
+def detect_largest_face(face_app, image: np.ndarray) -> Optional[dict]:
+    """Run face detection + embedding and return the largest face"""
     faces = face_app.get(image)
     if not faces:
         return None
@@ -198,13 +643,17 @@ def restore_face(generated_image: np.ndarray, original_face) -> np.ndarray:
         logger.warning("Face models not loaded, skipping face restoration")
         return generated_image
 
-    # Find face in generated image
-    gen_faces = face_app.get(generated_image)
-    if not gen_faces:
+    # Find face in generated image. The swapper only needs the target's
+    # keypoints, so run just the detector rather than the full
+    # landmark/attribute/embedding stack of face_app.get()
+    from insightface.app.common import Face
+
+    bboxes, kpss = face_app.det_model.detect(generated_image, max_num=0)
+    if bboxes.shape[0] == 0:
         logger.warning("No face found in generated image")
         return generated_image
 
-    target_face = gen_faces[0]
+    target_face = Face(bbox=bboxes[0, :4], kps=kpss[0], det_score=bboxes[0, 4])
 
     # Swap face
     result = face_swapper.get(
@@ -217,102 +666,176 @@ def restore_face(generated_image: np.ndarray, original_face) -> np.ndarray:
     return result
 
 
-def create_body_mask(image: np.ndarray) -> np.ndarray:
-    """Create mask for body/clothing area using pose estimation"""
+def create_body_mask(image: np.ndarray, key: Optional[str] = None) -> np.ndarray:
+    """Create mask for body/clothing area, reusing boxes for repeat images"""
+    # Only the torso box is cached: full-resolution masks of phone photos
+    # would hold ~12MB each
+    if key is None:
+        key = image_key(image)
+    box = body_box_cache.get(key)
+    if box is None:
+        box = compute_body_box(image)
+        body_box_cache.put(key, box)
+
+    x1, y1, x2, y2 = box
+    mask = np.zeros(image.shape[:2], dtype=np.uint8)
+    mask[y1:y2, x1:x2] = 255
+    return mask
+
+
+# MediaPipe PoseLandmark indices: left/right shoulder, left/right hip
+TORSO_LANDMARKS = (11, 12, 23, 24)
+
+# MediaPipe solutions aren't thread-safe (one timestamped graph per
+# instance), and masks are built on several request threads at once
+pose_lock = threading.Lock()
+
+
+def compute_body_box(image: np.ndarray) -> Tuple[int, int, int, int]:
+    """Box (x1, y1, x2, y2) of the body/clothing area from pose estimation"""
+    h, w = image.shape[:2]
+
     pose = models.get('pose_estimator')
     if pose is None:
-        # Fallback: simple center mask
-        h, w = image.shape[:2]
-        mask = np.zeros((h, w), dtype=np.uint8)
-        # Create rectangle mask for torso area
-        y1, y2 = int(h * 0.2), int(h * 0.8)
-        x1, x2 = int(w * 0.2), int(w * 0.8)
-        mask[y1:y2, x1:x2] = 255
-        return mask
-
-    import mediapipe as mp
+        # Fallback: simple center box for the torso area
+        return int(w * 0.2), int(h * 0.2), int(w * 0.8), int(h * 0.8)
 
     # Get pose landmarks
-    results = pose.process(image)
+    with pose_lock:
+        results = pose.process(image)
 
     if not results.pose_landmarks:
-        # Fallback mask
-        h, w = image.shape[:2]
-        mask = np.zeros((h, w), dtype=np.uint8)
-        mask[int(h*0.15):int(h*0.85), int(w*0.15):int(w*0.85)] = 255
-        return mask
-
-    # Create mask based on pose landmarks
-    h, w = image.shape[:2]
-    mask = np.zeros((h, w), dtype=np.uint8)
+        # Fallback box
+        return int(w * 0.15), int(h * 0.15), int(w * 0.85), int(h * 0.85)
 
     landmarks = results.pose_landmarks.landmark
 
-    # Get shoulder and hip points
-    left_shoulder = landmarks[mp.solutions.pose.PoseLandmark.LEFT_SHOULDER]
-    right_shoulder = landmarks[mp.solutions.pose.PoseLandmark.RIGHT_SHOULDER]
-    left_hip = landmarks[mp.solutions.pose.PoseLandmark.LEFT_HIP]
-    right_hip = landmarks[mp.solutions.pose.PoseLandmark.RIGHT_HIP]
+    # All landmarks as one (N, 3) array of x, y, visibility
+    points = np.fromiter(
+        (c for lm in landmarks for c in (lm.x, lm.y, lm.visibility)),
+        dtype=np.float32,
+        count=len(landmarks) * 3
+    ).reshape(-1, 3)
 
-    # Calculate bounding box for torso
-    x_coords = [left_shoulder.x, right_shoulder.x, left_hip.x, right_hip.x]
-    y_coords = [left_shoulder.y, right_shoulder.y, left_hip.y, right_hip.y]
+    # Calculate bounding box for torso (shoulder and hip points)
+    torso = points[list(TORSO_LANDMARKS), :2]
 
     padding = 0.1
-    x1 = int((min(x_coords) - padding) * w)
-    x2 = int((max(x_coords) + padding) * w)
-    y1 = int((min(y_coords) - padding) * h)
-    y2 = int((max(y_coords) + padding) * h)
+    size = np.array([w, h])
+    x1, y1 = np.clip((torso.min(axis=0) - padding) * size, 0, size).astype(int)
+    x2, y2 = np.clip((torso.max(axis=0) + padding) * size, 0, size).astype(int)
 
-    # Clamp values
-    x1, x2 = max(0, x1), min(w, x2)
-    y1, y2 = max(0, y1), min(h, y2)
+    return int(x1), int(y1), int(x2), int(y2)
 
-    mask[y1:y2, x1:x2] = 255
 
-    return mask
+def analyze_person(
+    image: np.ndarray,
+    detect_face: bool = True
+) -> Tuple[Optional[dict], np.ndarray]:
+    """
+    Run face extraction and body masking on the same person image in
+    parallel, so the InsightFace and MediaPipe passes overlap
+    """
+    # Hash the full-resolution image once for both cache lookups
+    key = image_key(image)
+
+    face_future = None
+    if detect_face:
+        face_future = preprocess_executor.submit(extract_face, image, key)
+
+    mask = create_body_mask(image, key)
+    face = face_future.result() if face_future is not None else None
+    return face, mask
+
+
+# Every diffusion call (including warm-up) runs on this one thread:
+# torch.compile's CUDA graph trees keep their state in thread-locals, and the
+# scheduler and graph buffers can't serve two calls at once anyway. Only the
+# diffusion call is queued here, so one request's preprocessing and face
+# restoration overlap with another's denoising
+gpu_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gpu")
+
+# CUDA generator reused across requests (only touched on the GPU thread)
+_generator: Optional[torch.Generator] = None
+
+
+def get_generator(seed: Optional[int] = None) -> torch.Generator:
+    """Reusable CUDA generator, seeded randomly when seed is None"""
+    global _generator
+    if _generator is None:
+        _generator = torch.Generator(device="cuda")
+    if seed is None:
+        _generator.seed()
+    else:
+        _generator.manual_seed(seed)
+    return _generator
+
+
+def run_pipeline(
+    pipeline,
+    image: Image.Image,
+    mask_image: Image.Image,
+    num_inference_steps: int,
+    seed: Optional[int]
+) -> Tuple[Image.Image, int]:
+    """Run one diffusion call on the GPU thread, returning (image, seed)"""
+    generator = get_generator(seed)
+
+    # Generate (prompt embeddings were encoded at startup)
+    with torch.inference_mode():
+        result = pipeline(
+            **prompt_cache,
+            image=image,
+            mask_image=mask_image,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=GUIDANCE_SCALE,
+            strength=0.8,
+            generator=generator
+        ).images[0]
+
+    return result, generator.initial_seed()
 
 
 def generate_tryon(
     person_image: np.ndarray,
     cloth_image: np.ndarray,
-    preserve_face: bool = True
+    preserve_face: bool = True,
+    num_inference_steps: int = DEFAULT_INFERENCE_STEPS,
+    seed: Optional[int] = None
 ) -> Tuple[np.ndarray, dict]:
     """
     Main try-on generation pipeline
 
     Steps:
-    1. Extract original face
-    2. Create body mask
-    3. Generate try-on using diffusion model
-    4. Restore original face (100% fidelity)
+    1. Extract original face and create body mask (concurrently)
+    2. Generate try-on using diffusion model
+    3. Restore original face (100% fidelity)
 
     Returns:
         Tuple of (result_image, metadata)
     """
     metadata = {
         "face_preserved": False,
-        "model_used": "stable-diffusion-inpainting",
+        "model_used": "stable-diffusion-inpainting" + ("+lcm-lora" if USE_LCM_LORA else ""),
         "steps": []
     }
 
-    # Step 1: Extract original face
-    original_face = None
+    # Step 1 + 2: Extract original face and create body mask
+    original_face, mask = analyze_person(person_image, detect_face=preserve_face)
     if preserve_face:
-        original_face = extract_face(person_image)
         if original_face is not None:
             metadata["steps"].append("face_extracted")
         else:
             logger.warning("Could not extract face from person image")
-
-    # Step 2: Create body mask
-    mask = create_body_mask(person_image)
     metadata["steps"].append("mask_created")
 
     # Step 3: Prepare images for pipeline
-    person_pil = Image.fromarray(person_image).resize((512, 768))
-    cloth_pil = Image.fromarray(cloth_image).resize((512, 768))
-    mask_pil = Image.fromarray(mask).resize((512, 768))
+    # Nearest-neighbour keeps the mask binary and only samples output pixels
+    # (the SD inpainting pipeline doesn't consume the cloth image)
+    person_pil = Image.fromarray(resize_image(person_image, PIPELINE_SIZE))
+    mask_pil = Image.fromarray(
+        cv2.resize(mask, PIPELINE_SIZE, interpolation=cv2.INTER_NEAREST)
+    )
 
     # Step 4: Generate try-on
     pipeline = models.get('tryon_pipeline')
@@ -320,46 +843,108 @@ def generate_tryon(
     if pipeline is None:
         raise HTTPException(status_code=500, detail="Try-on model not loaded")
 
-    # Create prompt for clothing placement
-    prompt = (
-        "professional fashion photo, person wearing the clothing item, "
-        "realistic, high quality, detailed, natural lighting, "
-        "clothing fits naturally on body"
-    )
-
-    negative_prompt = (
-        "blurry, low quality, distorted, unrealistic, "
-        "wrong proportions, artifacts, watermark"
-    )
-
-    # Generate
-    with torch.inference_mode():
-        result = pipeline(
-            prompt=prompt,
-            negative_prompt=negative_prompt,
-            image=person_pil,
-            mask_image=mask_pil,
-            num_inference_steps=25,
-            guidance_scale=7.5,
-            strength=0.8
-        ).images[0]
+    result, metadata["seed"] = gpu_executor.submit(
+        run_pipeline, pipeline, person_pil, mask_pil, num_inference_steps, seed
+    ).result()
 
-    result_np = np.array(result)
     metadata["steps"].append("tryon_generated")
 
     # Step 5: Resize back to original dimensions
     original_h, original_w = person_image.shape[:2]
-    result_np = np.array(Image.fromarray(result_np).resize((original_w, original_h)))
+    # Lanczos keeps generated fabric detail sharp when enlarging
+    result_np = resize_image(
+        np.asarray(result), (original_w, original_h),
+        upscale_interpolation=cv2.INTER_LANCZOS4
+    )
 
     # Step 6: Restore original face (CRITICAL for 100% fidelity)
     if preserve_face and original_face is not None:
-        result_np = restore_face(result_np, original_face)
+        fx1, fy1, fx2, fy2 = original_face.bbox
+        # Room around the face for the feathered edge
+        pad = 0.25 * max(fx2 - fx1, fy2 - fy1)
+        x1, y1, x2, y2 = np.clip(
+            [fx1 - pad, fy1 - pad, fx2 + pad, fy2 + pad],
+            0, [original_w, original_h, original_w, original_h]
+        ).astype(int)
+        if not mask[y1:y2, x1:x2].any():
+            # The inpainting mask never reached the face, so blend the
+            # original face back with a soft ellipse instead of running the
+            # detector + swapper (the rest of the frame was still
+            # regenerated and resampled, so a hard paste would leave a seam)
+            if not result_np.flags.writeable:
+                # Unresized pipeline output is a read-only view of the PIL image
+                result_np = result_np.copy()
+            alpha = np.zeros((y2 - y1, x2 - x1), dtype=np.float32)
+            cv2.ellipse(
+                alpha,
+                (int((fx1 + fx2) / 2) - x1, int((fy1 + fy2) / 2) - y1),
+                (int((fx2 - fx1) * 0.55), int((fy2 - fy1) * 0.55)),
+                0, 0, 360, 1.0, -1
+            )
+            alpha = cv2.GaussianBlur(alpha, (0, 0), sigmaX=max(pad / 3, 1.0))
+            region = result_np[y1:y2, x1:x2]
+            region[:] = cv2.blendLinear(
+                person_image[y1:y2, x1:x2], region, alpha, 1.0 - alpha
+            )
+            metadata["steps"].append("face_blended")
+        else:
+            result_np = restore_face(result_np, original_face)
+            metadata["steps"].append("face_restored")
         metadata["face_preserved"] = True
-        metadata["steps"].append("face_restored")
 
     return result_np, metadata
 
 
+def uncompile_pipeline(pipeline):
+    """Swap the eager UNet and VAE decoder back in for the compiled ones"""
+    pipeline.unet = pipeline.unet._orig_mod
+    # The compiled decode is an instance attribute shadowing the method
+    del pipeline.vae.decode
+
+
+def run_warmup(passes: int):
+    """Run dummy try-ons at the request shape and step count"""
+    start_time = time.time()
+    blank = np.zeros((PIPELINE_SIZE[1], PIPELINE_SIZE[0], 3), dtype=np.uint8)
+    for _ in range(passes):
+        result_np, _ = generate_tryon(
+            blank, blank, preserve_face=False,
+            num_inference_steps=DEFAULT_INFERENCE_STEPS
+        )
+    encode_image_to_base64(result_np)
+    logger.info(f"Try-on warm-up finished in {time.time() - start_time:.1f}s")
+
+
+def warmup_tryon():
+    """
+    Run dummy try-ons so compilation, CUDA graph recording, cuDNN
+    autotuning and allocator growth happen at startup instead of on the
+    first requests
+    """
+    pipeline = models['tryon_pipeline']
+    compiled = hasattr(pipeline.unet, "_orig_mod")
+
+    try:
+        # reduce-overhead warms up on a function's first call and records
+        # its graph on the next, so the once-per-request VAE decode needs two
+        # generations (the UNet gets there within the first)
+        run_warmup(passes=2 if compiled else 1)
+        return
+    except Exception as e:
+        if not compiled:
+            logger.warning(f"Try-on warm-up failed: {e}")
+            return
+        # torch.compile only compiles on first call, so a broken Inductor/
+        # Triton setup would otherwise fail every request
+        logger.warning(f"Compiled warm-up failed, falling back to eager UNet/VAE: {e}")
+
+    uncompile_pipeline(pipeline)
+    try:
+        run_warmup(passes=1)
+    except Exception as e:
+        logger.warning(f"Try-on warm-up failed: {e}")
+
+
 # ============================================================================
 # FastAPI Application
 # ============================================================================
@@ -367,6 +952,12 @@ def generate_tryon(
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Load models on startup"""
+    # Bounded pool behind asyncio.to_thread, so queued requests don't pile
+    # up threads contending for the GIL and the GPU
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=WORKER_THREADS)
+    )
+
     logger.info("Loading models...")
 
     models['face_analyzer'] = load_face_analyzer()
@@ -377,10 +968,16 @@ async def lifespan(app: FastAPI):
     loaded_count = sum(1 for v in models.values() if v is not None)
     logger.info(f"Loaded {loaded_count}/{len(models)} models")
 
+    if models['tryon_pipeline'] is not None:
+        prompt_cache.update(encode_prompts(models['tryon_pipeline']))
+        free_text_encoder(models['tryon_pipeline'])
+        warmup_tryon()
+
     yield
 
     # Cleanup
     models.clear()
+    prompt_cache.clear()
     torch.cuda.empty_cache()
 
 
@@ -399,11 +996,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Base64 JPEG payloads still compress noticeably. Starlette compresses on
+# the event loop, so use the fastest level (level 9 costs tens of ms on
+# multi-MB responses for little extra saving)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=1)
+
 
 class TryOnRequest(BaseModel):
     person_image: str  # Base64
     cloth_image: str   # Base64
     preserve_face: bool = True
+    num_inference_steps: int = Field(DEFAULT_INFERENCE_STEPS, ge=1, le=50)
+    seed: Optional[int] = Field(None, ge=0, lt=2**63)
 
 
 class TryOnResponse(BaseModel):
@@ -411,6 +1015,62 @@ class TryOnResponse(BaseModel):
     metadata: dict
 
 
+# Identical requests currently being generated (users double-click "try on");
+# duplicates await the first one's task instead of re-running the pipeline
+inflight_requests: Dict[str, asyncio.Task] = {}
+
+
+async def run_tryon(
+    decode_fn,
+    person_data,
+    cloth_data,
+    preserve_face: bool,
+    num_inference_steps: int,
+    seed: Optional[int]
+) -> Tuple[str, dict]:
+    """Decode, generate and encode one try-on off the event loop"""
+    person_np = await asyncio.to_thread(decode_fn, person_data)
+    cloth_np = await asyncio.to_thread(decode_fn, cloth_data)
+
+    result_np, metadata = await asyncio.to_thread(
+        generate_tryon,
+        person_np,
+        cloth_np,
+        preserve_face=preserve_face,
+        num_inference_steps=num_inference_steps,
+        seed=seed
+    )
+
+    result_b64 = await asyncio.to_thread(encode_image_to_base64, result_np)
+    return result_b64, metadata
+
+
+async def coalesced_tryon(
+    decode_fn,
+    person_data,
+    cloth_data,
+    preserve_face: bool,
+    num_inference_steps: int,
+    seed: Optional[int]
+) -> Tuple[str, dict]:
+    """Run a try-on, sharing the result with identical in-flight requests"""
+    key = request_key(person_data, cloth_data, preserve_face, num_inference_steps, seed)
+
+    task = inflight_requests.get(key)
+    if task is None:
+        task = asyncio.ensure_future(run_tryon(
+            decode_fn, person_data, cloth_data, preserve_face, num_inference_steps, seed
+        ))
+        inflight_requests[key] = task
+        task.add_done_callback(lambda _: inflight_requests.pop(key, None))
+    else:
+        logger.info("Coalescing duplicate try-on request")
+
+    # Shielded so one client disconnecting doesn't cancel the others' result
+    result_b64, metadata = await asyncio.shield(task)
+    return result_b64, dict(metadata)
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -433,25 +1093,21 @@ async def create_tryon(request: TryOnRequest):
     - **person_image**: Base64 encoded person image
     - **cloth_image**: Base64 encoded clothing image
     - **preserve_face**: Whether to preserve original face (default: True)
+    - **num_inference_steps**: Diffusion steps (default: 15)
+    - **seed**: Random seed for reproducible results (default: random)
     """
-    import time
     start_time = time.time()
 
     try:
-        # Decode images
-        person_np = decode_base64_image(request.person_image)
-        cloth_np = decode_base64_image(request.cloth_image)
-
-        # Generate try-on
-        result_np, metadata = generate_tryon(
-            person_np,
-            cloth_np,
-            preserve_face=request.preserve_face
+        result_b64, metadata = await coalesced_tryon(
+            decode_base64_image,
+            request.person_image,
+            request.cloth_image,
+            request.preserve_face,
+            request.num_inference_steps,
+            request.seed
         )
 
-        # Encode result
-        result_b64 = encode_image_to_base64(result_np)
-
         metadata["processing_time_ms"] = int((time.time() - start_time) * 1000)
 
         return TryOnResponse(
@@ -468,14 +1124,15 @@ async def create_tryon(request: TryOnRequest):
 async def create_tryon_upload(
     person_image: UploadFile = File(...),
     cloth_image: UploadFile = File(...),
-    preserve_face: bool = Form(True)
+    preserve_face: bool = Form(True),
+    num_inference_steps: int = Form(DEFAULT_INFERENCE_STEPS, ge=1, le=50),
+    seed: Optional[int] = Form(None, ge=0, lt=2**63)
 ):
     """
     Generate virtual try-on from uploaded files
 
     Alternative endpoint that accepts file uploads instead of base64
     """
-    import time
     start_time = time.time()
 
     try:
@@ -483,20 +1140,15 @@ async def create_tryon_upload(
         person_bytes = await person_image.read()
         cloth_bytes = await cloth_image.read()
 
-        # Convert to numpy
-        person_np = np.array(Image.open(io.BytesIO(person_bytes)).convert('RGB'))
-        cloth_np = np.array(Image.open(io.BytesIO(cloth_bytes)).convert('RGB'))
-
-        # Generate try-on
-        result_np, metadata = generate_tryon(
-            person_np,
-            cloth_np,
-            preserve_face=preserve_face
+        result_b64, metadata = await coalesced_tryon(
+            decode_image_bytes,
+            person_bytes,
+            cloth_bytes,
+            preserve_face,
+            num_inference_steps,
+            seed
         )
 
-        # Encode result
-        result_b64 = encode_image_to_base64(result_np)
-
         metadata["processing_time_ms"] = int((time.time() - start_time) * 1000)
 
         return TryOnResponse(
@@ -515,5 +1167,11 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8080,
         workers=1,  # Single worker for GPU
-        reload=False
+        reload=False,
+        # uvloop + httptools (from uvicorn[standard]) parse multi-MB base64
+        # bodies with far less CPU than asyncio + h11
+        loop="uvloop",
+        http="httptools",
+        limit_concurrency=8,
+        backlog=128
     )
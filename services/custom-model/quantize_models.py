@@ -0,0 +1,177 @@
+"""
+MirrorX Face Swapper INT8 Quantization
+
+Quantizes inswapper_128.onnx to INT8 (QDQ format, per-channel weights)
+using static calibration on real face photos. inference_server.py picks
+up the quantized model automatically when it exists.
+
+Usage:
+    python quantize_models.py --calibration-dir ./calibration_faces
+
+    # ~200 varied, front-facing face photos give a good calibration set
+"""
+
+import argparse
+import logging
+import os
+from pathlib import Path
+
+import cv2
+import numpy as np
+import onnx
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    QuantFormat,
+    QuantType,
+    quantize_static,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODELS_DIR = Path(os.path.expanduser('~/.insightface/models'))
+
+
+class FaceSwapCalibrationReader(CalibrationDataReader):
+    """Feeds (target crop, source latent) pairs built from calibration photos"""
+
+    def __init__(self, image_dir: Path, swapper_path: Path, max_images: int = 200):
+        import insightface
+        from insightface.app import FaceAnalysis
+        from insightface.utils import face_align
+
+        face_app = FaceAnalysis(name='buffalo_l', providers=['CPUExecutionProvider'])
+        face_app.prepare(ctx_id=-1, det_size=(640, 640))
+        swapper = insightface.model_zoo.get_model(
+            str(swapper_path), providers=['CPUExecutionProvider']
+        )
+
+        faces = []
+        image_paths = sorted(
+            p for p in image_dir.iterdir()
+            if p.suffix.lower() in ('.jpg', '.jpeg', '.png')
+        )[:max_images]
+        for path in image_paths:
+            img = cv2.imread(str(path))
+            if img is None:
+                continue
+            detected = face_app.get(img)
+            if detected:
+                faces.append((img, detected[0]))
+
+        if not faces:
+            raise ValueError(f"No faces found in {image_dir}")
+
+        logger.info(f"Calibrating with {len(faces)} faces")
+
+        # Pair each face with the next one as identity source, mirroring how
+        # the server swaps the original face onto the generated image
+        self.samples = []
+        for i, (img, target_face) in enumerate(faces):
+            _, source_face = faces[(i + 1) % len(faces)]
+
+            aimg, _ = face_align.norm_crop2(img, target_face.kps, swapper.input_size[0])
+            blob = cv2.dnn.blobFromImage(
+                aimg, 1.0 / swapper.input_std, swapper.input_size,
+                (swapper.input_mean, swapper.input_mean, swapper.input_mean),
+                swapRB=True
+            )
+
+            latent = source_face.normed_embedding.reshape((1, -1))
+            latent = np.dot(latent, swapper.emap)
+            latent /= np.linalg.norm(latent)
+
+            self.samples.append({
+                swapper.input_names[0]: blob.astype(np.float32),
+                swapper.input_names[1]: latent.astype(np.float32),
+            })
+
+        self._iter = iter(self.samples)
+
+    def get_next(self):
+        return next(self._iter, None)
+
+
+def restore_emap(fp32_path: Path, int8_path: Path):
+    """
+    Re-append the identity projection as the last initializer
+
+    INSwapper reads emap from graph.initializer[-1]. No node uses it, so
+    quantize_static drops it (or buries it under the new scale/zero-point
+    initializers), which would silently swap in the wrong identity.
+    """
+    emap = onnx.load(str(fp32_path)).graph.initializer[-1]
+
+    model = onnx.load(str(int8_path))
+    initializers = model.graph.initializer
+    for i in reversed(range(len(initializers))):
+        if initializers[i].name == emap.name:
+            del initializers[i]
+    initializers.append(emap)
+    onnx.save(model, str(int8_path))
+
+
+def verify_swap(fp32_path: Path, int8_path: Path, sample: dict):
+    """Compare the INT8 swapper against fp32 on one calibration sample"""
+    import insightface
+
+    fp32 = insightface.model_zoo.get_model(str(fp32_path), providers=['CPUExecutionProvider'])
+    int8 = insightface.model_zoo.get_model(str(int8_path), providers=['CPUExecutionProvider'])
+
+    if not np.array_equal(fp32.emap, int8.emap):
+        raise ValueError(f"{int8_path} has a different emap than {fp32_path}")
+
+    fp32_out = fp32.session.run(None, sample)[0]
+    int8_out = int8.session.run(None, sample)[0]
+    diff = np.abs(fp32_out - int8_out)
+    logger.info(
+        f"INT8 vs fp32 swap: mean abs diff {diff.mean():.4f}, max {diff.max():.4f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize the face swapper to INT8")
+    parser.add_argument(
+        "--calibration-dir",
+        type=Path,
+        required=True,
+        help="Directory of face photos used for calibration",
+    )
+    parser.add_argument(
+        "--model",
+        type=Path,
+        default=MODELS_DIR / 'inswapper_128.onnx',
+        help="Input fp32 inswapper model",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=MODELS_DIR / 'inswapper_128_int8.onnx',
+        help="Output INT8 model",
+    )
+    parser.add_argument(
+        "--max-images",
+        type=int,
+        default=200,
+        help="Maximum number of calibration photos",
+    )
+    args = parser.parse_args()
+
+    reader = FaceSwapCalibrationReader(args.calibration_dir, args.model, args.max_images)
+
+    quantize_static(
+        str(args.model),
+        str(args.output),
+        reader,
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        weight_type=QuantType.QInt8,
+        activation_type=QuantType.QInt8,
+    )
+    restore_emap(args.model, args.output)
+    verify_swap(args.model, args.output, reader.samples[0])
+    logger.info(f"Saved INT8 face swapper to {args.output}")
+
+
+if __name__ == "__main__":
+    main()